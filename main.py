@@ -1,22 +1,113 @@
+# openai, httpx, yt_dlp, numpy and aiohttp are imported inside the functions that use
+# them, so the password screen and a cold start don't pay for loading them
 import os
 import shutil
+import asyncio
 import streamlit as st
-from openai import OpenAI
-import yt_dlp
 import re
 import unicodedata
 import random
-import string
+import secrets
 import logging
+import logging.handlers
+import queue
+import atexit
 import sys
 import tempfile
-import ffmpeg
+import subprocess
+import hashlib
+import zlib
+import json
+import time
+import mimetypes
+import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Audio codecs Whisper accepts as-is, mapped to the container used when stream-copying them
+STREAM_COPY_EXTENSIONS = {'aac': '.m4a', 'mp3': '.mp3', 'opus': '.ogg'}
+
+# Buffer size used when streaming uploaded files to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Maximum number of requests sent to the OpenAI API at the same time
+MAX_CONCURRENT_REQUESTS = 4
+
+# Long media is transcribed in chunks of this many seconds, sent to Whisper concurrently
+# At 16 kHz mono 16-bit PCM even the longest chunk (1.25 × this) stays under Whisper's 25 MB upload limit
+CHUNK_SECONDS = 480
+# Each chunk also covers the first seconds of the next one, so no word is cut in half
+CHUNK_OVERLAP_SECONDS = 3
+# Longest run of words that is checked for duplication where two chunk transcripts meet
+MAX_OVERLAP_WORDS = 15
+
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.mpeg')
+SUPPORTED_EXTENSIONS = ('.mp4', '.m4a', '.mp3', '.webm', '.mpga', '.wav', '.mpeg', '.ogg')
+
+LANGUAGE_CODES = {"Arabic": "ar", "Hebrew": "he", "English": "en"}
+
+_INVALID_FILENAME_CHARS_RE = re.compile(r'[\\/*?:"<>|()]')
+_SPACE_TO_UNDERSCORE = str.maketrans({' ': '_'})
+
+WHISPER_MODEL = "whisper-1"
+WHISPER_URL = "https://api.openai.com/v1/audio/transcriptions"
+# Whisper uploads are retried with exponential back-off on 429 and 5xx responses
+WHISPER_MAX_RETRIES = 5
+WHISPER_TIMEOUT_SECONDS = 600
+# Once less than this fraction of the rate limit is left, requests pause until it resets
+RATE_LIMIT_LOW_WATERMARK = 0.1
+# Retries and per-request timeout of the OpenAI SDK clients (chat, embeddings, batches)
+OPENAI_MAX_RETRIES = 2
+OPENAI_TIMEOUT_SECONDS = 120.0
+# Connection pool of the OpenAI SDK clients, which speak HTTP/2 so concurrent requests share connections
+OPENAI_MAX_CONNECTIONS = 64
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 32
+GPT_MODEL = "gpt-4o" # Corrected from gpt-4.1 to a valid model
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Only the start of a transcript is embedded; the model takes at most 8191 tokens, and even
+# at one token per character (Hebrew and Arabic come close) this stays below that
+EMBEDDING_INPUT_MAX_CHARS = 8000
+
+# Transcripts up to this many estimated tokens are analyzed together in grouped GPT-4o requests
+SHORT_TRANSCRIPT_TOKENS = 4000
+# Upper bound on the estimated tokens of the transcripts sent in one grouped request
+ANALYSIS_GROUP_MAX_TOKENS = 60000
+# Waiting short transcripts are grouped and analyzed once there are this many, without waiting for longer files
+ANALYSIS_GROUP_START_FILES = 8
+# Each transcript of a grouped request, and its analysis in the reply, starts with this line
+ANALYSIS_FILE_MARKER = "===FILE: {}==="
+_ANALYSIS_FILE_MARKER_RE = re.compile(r'^===FILE: (.+?)===[ \t]*$', re.MULTILINE)
+GROUPED_ANALYSIS_INSTRUCTIONS = (
+    "The user message contains several transcripts, each starting with a line of the form "
+    "'===FILE: <name>==='. Apply the instructions above to each transcript separately. "
+    "Start the answer for each transcript with its marker line, repeated exactly."
+)
+
+# Cosine similarity above which a cached GPT-4o analysis is reused for a new transcription
+SEMANTIC_CACHE_THRESHOLD = 0.90
+# Least recently used entries are evicted once the semantic cache grows past this size
+SEMANTIC_CACHE_MAX_ENTRIES = 500
+# Shown with a file whose analysis was taken from the semantic cache
+SEMANTIC_CACHE_WARNING = (
+    "The AI analysis was reused from a similar transcript processed earlier, not generated for this file."
+)
+
+# Number of processing jobs that can run in the background at once, across all sessions
+MAX_BACKGROUND_JOBS = 2
+# Seconds between reruns of the job progress fragment while a background job is in progress
+JOB_POLL_SECONDS = 1.0
+
+# zlib level for the transcripts kept in session_state; text shrinks 3-5x at this level
+TRANSCRIPT_COMPRESSION_LEVEL = 6
 
 # --- Utility and Core Functions ---
 
 def setup_logging(log_dir):
     """
     Sets up logging to output to both a file and the console (terminal).
+    Log calls only enqueue the record; a background QueueListener thread does the
+    actual file and console writes, so logging never blocks the processing code.
     """
     os.makedirs(log_dir, exist_ok=True)
     log_file = os.path.join(log_dir, 'app.log')
@@ -37,98 +128,428 @@ def setup_logging(log_dir):
         file_handler = logging.FileHandler(log_file)
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
 
         # Stream handler - prints logs to the console/terminal
         stream_handler = logging.StreamHandler(sys.stdout)
         stream_handler.setLevel(logging.INFO)
         stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+
+        # Queue handler - the only handler on the root logger, drained by the listener thread
+        log_queue = queue.Queue(-1)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(
+            log_queue, file_handler, stream_handler, respect_handler_level=True
+        )
+        listener.start()
+        # Flush whatever is still queued when the server shuts down
+        atexit.register(listener.stop)
     
     logging.info(f"Logging initialized. Log file at: {log_file}")
 
+@st.cache_resource
+def init_app():
+    """
+    Creates the working directories and sets up logging. Cached as a resource, so it
+    runs once per server process instead of on every rerun. Returns the paths dict.
+    """
+    # Use a relative directory path that's writable in Streamlit Community Cloud
+    base_temp_dir = os.path.join(".", "temp_files")
+    paths = {
+        'logs': os.path.join(base_temp_dir, 'logs'),
+        'to_transcribe': os.path.join(base_temp_dir, 'to_transcribe'),
+        'done_vids': os.path.join(base_temp_dir, 'done_vids'),
+        'cache': os.path.join(base_temp_dir, 'cache'),
+        # Extracted audio chunks; kept out of to_transcribe so they are never picked up as input
+        'work': os.path.join(base_temp_dir, 'work')
+    }
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    setup_logging(paths['logs'])
+    return paths
+
+
+@st.cache_resource
+def get_openai_client(api_key):
+    """
+    Returns a synchronous OpenAI client shared across reruns and sessions.
+    The AsyncOpenAI client used for processing is created per run instead, because
+    its connection pool is bound to the event loop of that run.
+    """
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+    http_client = DefaultHttpxClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+        )
+    )
+    return OpenAI(
+        api_key=api_key, max_retries=OPENAI_MAX_RETRIES, timeout=OPENAI_TIMEOUT_SECONDS, http_client=http_client
+    )
+
+@st.cache_resource
+def get_ffmpeg_executor():
+    """
+    Returns the thread pool that runs ffprobe and ffmpeg, shared across reruns and sessions.
+    It is sized to the CPU count and its threads are started on demand and kept alive, so
+    consecutive runs reuse warm workers and extractions of every file and chunk overlap.
+    """
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='ffmpeg')
+
+@st.cache_resource
+def get_semantic_cache_lock():
+    """Returns the lock guarding the semantic cache files, shared by the jobs of all sessions."""
+    return threading.Lock()
+
+@st.cache_resource
+def get_job_executor():
+    """Returns the thread pool that runs processing jobs in the background, shared across sessions."""
+    return ThreadPoolExecutor(max_workers=MAX_BACKGROUND_JOBS, thread_name_prefix='job')
 
+@st.cache_data(max_entries=1024)
 def sanitize_filename(filename):
     """Cleans a string to be a valid filename."""
     logging.info(f"Sanitizing filename: '{filename}'")
     # Remove problematic characters like parentheses, etc.
-    sanitized = re.sub(r'[\\/*?:"<>|()]', "", filename)
-    sanitized = sanitized.replace(' ', '_')
-    # Normalize unicode characters
-    sanitized = unicodedata.normalize('NFKD', sanitized).encode('ASCII', 'ignore').decode('ASCII')
+    sanitized = _INVALID_FILENAME_CHARS_RE.sub("", filename).translate(_SPACE_TO_UNDERSCORE)
+    # Normalize unicode characters (pure ASCII names, the common case, need no normalization)
+    if not sanitized.isascii():
+        sanitized = unicodedata.normalize('NFKD', sanitized).encode('ASCII', 'ignore').decode('ASCII')
     logging.info(f"Sanitized name: '{sanitized}'")
     return sanitized
 
-def extract_audio(video_file, output_file):
-    """Extracts audio from a video file and saves it as an MP3 file."""
-    logging.info(f"Starting audio extraction from '{os.path.basename(video_file)}' to '{os.path.basename(output_file)}'.")
-    st.write(f"Extracting audio from {os.path.basename(video_file)}...")
+def probe_audio(media_file):
+    """
+    Returns (codec name, duration in seconds) for the first audio stream of a media file.
+    The codec is None if the file has no audio track; the duration is None if unknown.
+    """
+    completed = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', media_file],
+        capture_output=True
+    )
+    if completed.returncode != 0:
+        error_message = completed.stderr.decode(errors='replace').strip()
+        raise RuntimeError(error_message or f"ffprobe exited with status {completed.returncode}")
+    probe = json.loads(completed.stdout)
+    audio_codec = None
+    for stream in probe.get('streams', []):
+        if stream.get('codec_type') == 'audio':
+            audio_codec = stream.get('codec_name')
+            break
     try:
-        # Remove existing output file if it exists to avoid conflicts
-        if os.path.exists(output_file):
-            os.remove(output_file)
-            logging.info(f"Removed existing output file: {output_file}")
-        
-        ffmpeg.input(video_file).output(output_file, acodec='libmp3lame', loglevel='quiet').run(overwrite_output=True)
-        
-        # Validate that the output file was created successfully
-        if not os.path.exists(output_file):
-            error_message = f"Audio extraction failed: Output file '{os.path.basename(output_file)}' was not created."
-            st.error(error_message)
-            logging.error(error_message)
-            raise RuntimeError(error_message)
-        
-        # Check if the output file has content
-        if os.path.getsize(output_file) == 0:
-            error_message = f"Audio extraction failed: Output file '{os.path.basename(output_file)}' is empty."
-            st.error(error_message)
-            logging.error(error_message)
-            raise RuntimeError(error_message)
-        
-        st.write(f"Audio extracted for {os.path.basename(video_file)}.")
-        logging.info(f"Audio extraction successful. Output file size: {os.path.getsize(output_file)} bytes.")
+        duration = float(probe['format']['duration'])
+    except (KeyError, TypeError, ValueError):
+        duration = None
+    return audio_codec, duration
+
+def get_chunk_windows(duration, chunk_sec=CHUNK_SECONDS, overlap_sec=CHUNK_OVERLAP_SECONDS):
+    """
+    Splits a media duration into (start, length) windows of `chunk_sec` seconds, each
+    running `overlap_sec` seconds into the next. The last window runs to the end of the
+    file (length None) and absorbs a short remainder instead of producing a tiny chunk.
+    Returns [(None, None)], the whole file, when the media fits in a single chunk.
+    """
+    windows = []
+    start = 0
+    while duration is not None and duration - start > chunk_sec * 1.25:
+        windows.append((start, chunk_sec + overlap_sec))
+        start += chunk_sec
+    windows.append((start or None, None))
+    return windows
+
+def _normalize_word(word):
+    return re.sub(r'\W', '', word.casefold())
+
+def merge_chunk_transcripts(texts, max_overlap_words=MAX_OVERLAP_WORDS):
+    """
+    Joins chunk transcripts in order. Because consecutive chunks overlap in time, the
+    start of a chunk usually repeats the end of the previous one; the longest such
+    repeat (up to `max_overlap_words`, ignoring case and punctuation) is dropped.
+    """
+    if len(texts) == 1:
+        return texts[0]
+    merged_words = []
+    for text in texts:
+        words = text.split()
+        normalized_tail = [_normalize_word(w) for w in merged_words[-max_overlap_words:]]
+        normalized_head = [_normalize_word(w) for w in words[:max_overlap_words]]
+        overlap = 0
+        for size in range(min(len(normalized_tail), len(normalized_head)), 0, -1):
+            if normalized_tail[-size:] == normalized_head[:size]:
+                overlap = size
+                break
+        merged_words.extend(words[overlap:])
+    return " ".join(merged_words)
+
+def extract_audio(media_file, output_base, audio_codec, start=None, duration=None):
+    """Extracts the audio of a media file, or of a window of it, and returns its Path."""
+    logging.info(f"Starting audio extraction from '{os.path.basename(media_file)}' (start={start}, duration={duration}).")
+    copy_extension = STREAM_COPY_EXTENSIONS.get(audio_codec)
+    output_file = output_base + (copy_extension or '.wav')
+
+    # -threads 0 lets ffmpeg pick a thread count for the available cores
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-threads', '0']
+    if start is not None:
+        command += ['-ss', str(start)]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    command += ['-i', media_file, '-vn']
+    if copy_extension is not None:
+        logging.info(f"Stream-copying '{audio_codec}' audio to '{os.path.basename(output_file)}'.")
+        command += ['-c:a', 'copy']
+    else:
+        # A WAV header carries the data size, so this is written to disk rather than piped
+        logging.info(f"Converting '{audio_codec}' audio to 16 kHz mono WAV '{os.path.basename(output_file)}'.")
+        command += ['-filter_threads', str(os.cpu_count() or 1), '-c:a', 'pcm_s16le', '-ac', '1', '-ar', '16000']
+    command.append(output_file)
+
+    try:
+        subprocess.run(command, check=True, capture_output=True)
     except FileNotFoundError:
         error_message = "FFmpeg is not installed or not found in system PATH. Please install FFmpeg first."
-        st.error(error_message)
         logging.critical(error_message) # Use critical for fatal setup errors
-        raise
-    except ffmpeg.Error as e:
-        # Handle stderr decoding more safely
-        if hasattr(e, 'stderr') and e.stderr is not None:
-            try:
-                error_message = e.stderr.decode() if isinstance(e.stderr, bytes) else str(e.stderr)
-            except (UnicodeDecodeError, AttributeError):
-                error_message = str(e)
-        else:
-            error_message = str(e)
-        st.error(f"An error occurred during audio extraction: {error_message}")
+        raise RuntimeError(error_message)
+    except subprocess.CalledProcessError as e:
+        error_message = e.stderr.decode(errors='replace').strip() or str(e)
         logging.error(f"FFmpeg error: {error_message}")
+        raise RuntimeError(f"An error occurred during audio extraction: {error_message}") from e
+
+    # Check that the output file was created and has content
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        error_message = f"Audio extraction failed: Output file '{os.path.basename(output_file)}' is missing or empty."
+        logging.error(error_message)
+        raise RuntimeError(error_message)
+
+    logging.info(f"Audio extraction successful. Output file size: {os.path.getsize(output_file)} bytes.")
+    return Path(output_file)
+
+def compute_file_sha256(file_path, chunk_size=1024 * 1024):
+    """Computes the SHA-256 hex digest of a file, reading it in chunks."""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def load_cached_json(cache_dir, key):
+    """Returns the cached JSON entry stored under `key`, or None if there is none."""
+    cache_file = os.path.join(cache_dir, f"{key}.json")
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable cache entry '{cache_file}': {e}")
+        return None
+
+def write_file_atomically(target_path, write_func, binary=False):
+    """Writes a file through a temp file and os.replace, so readers never see a partial file."""
+    target_dir = os.path.dirname(target_path)
+    os.makedirs(target_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=".tmp")
+    try:
+        if binary:
+            with os.fdopen(fd, "wb") as f:
+                write_func(f)
+        else:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                write_func(f)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         raise
-    except Exception as e:
-        error_message = f"Unexpected error during audio extraction: {str(e)}"
-        st.error(error_message)
-        logging.error(f"Unexpected audio extraction error: {type(e).__name__}: {str(e)}")
-        raise
+
+def save_cached_json(cache_dir, key, data):
+    """Writes a JSON cache entry atomically."""
+    try:
+        write_file_atomically(
+            os.path.join(cache_dir, f"{key}.json"),
+            lambda f: json.dump(data, f, ensure_ascii=False)
+        )
+    except OSError as e:
+        # A failed cache write only costs a future API call, so don't fail the file
+        logging.warning(f"Could not write cache entry '{key}' to '{cache_dir}': {e}")
+
+def move_file(source, destination):
+    """
+    Moves a file with a single rename when both paths are on the same filesystem,
+    falling back to shutil.move (copy and delete) only when the rename fails.
+    """
+    try:
+        os.replace(source, destination)
+    except OSError:
+        shutil.move(source, destination)
+
+def decompress_text(blob):
+    """Restores a transcript file built by format_transcript."""
+    return zlib.decompress(blob).decode("utf-8")
+
+def read_semantic_cache_files(cache_dir):
+    """Reads embeddings.npy and entries.jsonl; returns (None, []) if there is no cache yet."""
+    import numpy as np
+    try:
+        embeddings = np.load(os.path.join(cache_dir, 'embeddings.npy'))
+        with open(os.path.join(cache_dir, 'entries.jsonl'), "r", encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(entries):
+            raise ValueError("embeddings and entries are out of sync")
+    except FileNotFoundError:
+        return None, []
+    except (OSError, ValueError) as e:
+        logging.warning(f"Discarding unreadable semantic cache in '{cache_dir}': {e}")
+        return None, []
+    return embeddings.astype(np.float32, copy=False), entries
+
+def load_semantic_cache(cache_dir, lock):
+    """
+    Loads the semantic cache: an L2-normalized float32 embedding matrix (one row per
+    entry) stored in embeddings.npy, and the matching entries in entries.jsonl.
+    `lock` (see get_semantic_cache_lock) serializes access to the files.
+    """
+    with lock:
+        embeddings, entries = read_semantic_cache_files(cache_dir)
+    logging.info(f"Loaded semantic cache with {len(entries)} entries.")
+    return {'dir': cache_dir, 'lock': lock, 'embeddings': embeddings, 'entries': entries, 'dirty': False}
+
+def save_semantic_cache(cache):
+    """
+    Persists the semantic cache if it changed, evicting least recently used entries first.
+    Entries another job saved since this cache was loaded are merged in, not overwritten.
+    """
+    import numpy as np
+    if not cache['dirty']:
+        return
+    with cache['lock']:
+        entries = list(cache['entries'])
+        embeddings = cache['embeddings']
+        disk_embeddings, disk_entries = read_semantic_cache_files(cache['dir'])
+        known = {(entry['prompt_key'], entry['content']): entry for entry in entries}
+        new_rows = []
+        for index, entry in enumerate(disk_entries):
+            match = known.get((entry['prompt_key'], entry['content']))
+            if match is not None:
+                match['last_used'] = max(match['last_used'], entry['last_used'])
+            elif embeddings is None or disk_embeddings.shape[1] == embeddings.shape[1]:
+                entries.append(entry)
+                new_rows.append(index)
+        if new_rows:
+            merged_rows = disk_embeddings[new_rows]
+            embeddings = merged_rows if embeddings is None else np.vstack([embeddings, merged_rows])
+        if len(entries) > SEMANTIC_CACHE_MAX_ENTRIES:
+            keep = np.argsort([entry['last_used'] for entry in entries])[-SEMANTIC_CACHE_MAX_ENTRIES:]
+            keep.sort()
+            logging.info(f"Evicting {len(entries) - len(keep)} least recently used semantic cache entries.")
+            entries = [entries[i] for i in keep]
+            embeddings = embeddings[keep]
+        try:
+            write_file_atomically(
+                os.path.join(cache['dir'], 'embeddings.npy'), lambda f: np.save(f, embeddings), binary=True
+            )
+            write_file_atomically(
+                os.path.join(cache['dir'], 'entries.jsonl'),
+                lambda f: f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+            )
+        except OSError as e:
+            logging.warning(f"Could not write semantic cache to '{cache['dir']}': {e}")
+            return
+    cache['entries'], cache['embeddings'], cache['dirty'] = entries, embeddings, False
+
+def find_semantic_match(cache, query_embedding, prompt_key):
+    """Returns the cached content most similar to the query embedding, if it clears the threshold."""
+    import numpy as np
+    if not cache['entries']:
+        return None
+    similarities = cache['embeddings'] @ query_embedding
+    same_prompt = np.fromiter(
+        (entry['prompt_key'] == prompt_key for entry in cache['entries']), dtype=bool, count=len(cache['entries'])
+    )
+    similarities = np.where(same_prompt, similarities, -1.0)
+    best_index = int(np.argmax(similarities))
+    if similarities[best_index] < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    entry = cache['entries'][best_index]
+    entry['last_used'] = time.time()
+    cache['dirty'] = True
+    logging.info(f"Semantic cache hit with cosine similarity {similarities[best_index]:.3f}.")
+    return entry['content']
+
+def add_semantic_entry(cache, embedding, prompt_key, content):
+    """Appends a new embedding row and its content to the in-memory semantic cache."""
+    import numpy as np
+    row = embedding[np.newaxis, :]
+    if cache['embeddings'] is None or cache['embeddings'].shape[1] != row.shape[1]:
+        cache['embeddings'], cache['entries'] = row, []
+    else:
+        cache['embeddings'] = np.vstack([cache['embeddings'], row])
+    cache['entries'].append({'prompt_key': prompt_key, 'content': content, 'last_used': time.time()})
+    cache['dirty'] = True
+
+def list_media_files(directory):
+    """Lists the supported media files in a directory, skipping subdirectories and other artifacts."""
+    with os.scandir(directory) as entries:
+        return sorted(
+            entry.name for entry in entries
+            if entry.is_file() and entry.name.lower().endswith(SUPPORTED_EXTENSIONS)
+        )
 
 def generate_random_string(length=8):
     """Generates a random string for unique filenames."""
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=length))
+    # token_hex yields two characters per byte; round up and trim so odd lengths are honored
+    return secrets.token_hex((length + 1) // 2)[:length]
 
-def download_facebook_video(url, download_dir):
-    """Downloads a video from a URL using yt-dlp."""
+def find_downloaded_video(directory, url_key):
+    """Returns the name of a finished download for `url_key` in a directory, or None."""
+    for path in glob.glob(os.path.join(glob.escape(directory), f'fb_video_{url_key}.*')):
+        if path.lower().endswith(SUPPORTED_EXTENSIONS):
+            return os.path.basename(path)
+    return None
+
+def download_facebook_video(url, download_dir, archive_dir=None):
+    """
+    Downloads a video from a URL using yt-dlp.
+    Downloads are named after a hash of the URL, so a URL that was already fetched is
+    reused from `download_dir`, or moved back from `archive_dir` (where processed files
+    end up), without contacting Facebook again.
+    """
+    import yt_dlp
     logging.info(f"Attempting to download video from URL: {url}")
-    random_id = generate_random_string()
+    url_key = hashlib.sha1(url.strip().encode("utf-8")).hexdigest()[:12]
+
+    existing = find_downloaded_video(download_dir, url_key)
+    if existing is None and archive_dir:
+        existing = find_downloaded_video(archive_dir, url_key)
+        if existing is not None:
+            move_file(os.path.join(archive_dir, existing), os.path.join(download_dir, existing))
+    if existing is not None:
+        st.success(f"Reusing previous download: {existing}")
+        logging.info(f"URL was already downloaded to '{existing}', skipping the download.")
+        return existing
+
     ydl_opts = {
-        'format': 'best',
-        'outtmpl': os.path.join(download_dir, f'fb_video_{random_id}.%(ext)s'),
+        # Only the audio is transcribed, so prefer an audio-only stream when one is offered
+        'format': 'bestaudio/best',
+        'outtmpl': os.path.join(download_dir, f'fb_video_{url_key}.%(ext)s'),
         'quiet': True,
         'noplaylist': True,
+        # Fetch DASH fragments in parallel and in large HTTP chunks
+        'concurrent_fragment_downloads': 8,
+        'http_chunk_size': 10 * 1024 * 1024,
+        'retries': 3,
+        'fragment_retries': 3,
+        # Convert to the 16 kHz mono WAV Whisper needs as part of the download, so the
+        # result is treated as an audio file and never goes through extract_audio
+        'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'wav'}],
+        'postprocessor_args': {'extractaudio': ['-ar', '16000', '-ac', '1']},
     }
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         try:
             st.write(f"Downloading video from URL...")
             info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
+            # prepare_filename gives the name before postprocessing, so prefer the final path
+            requested_downloads = info.get('requested_downloads') or [{}]
+            filename = requested_downloads[0].get('filepath') or ydl.prepare_filename(info)
             base_filename = os.path.basename(filename)
             st.success(f"Downloaded: {base_filename}")
             logging.info(f"Successfully downloaded video to '{base_filename}'")
@@ -139,96 +560,658 @@ def download_facebook_video(url, download_dir):
             logging.error(error_message)
             return None
 
-def get_gpt4o_response(api_key, user_input, system_prompt):
-    """Gets a response from the OpenAI Chat API."""
+async def get_query_embedding(client, text):
+    """Returns the L2-normalized embedding of the start of a text, or None if the embedding call fails."""
+    import numpy as np
+    try:
+        response = await client.embeddings.create(model=EMBEDDING_MODEL, input=text[:EMBEDDING_INPUT_MAX_CHARS])
+    except Exception as e:
+        logging.warning(f"Embedding request failed, skipping semantic cache: {e}")
+        return None
+    embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+def gpt_cache_key(system_prompt, user_input):
+    """Returns the exact-match cache key of a GPT-4o request."""
+    return hashlib.sha256(f"{system_prompt}\x00{user_input}\x00{GPT_MODEL}".encode("utf-8")).hexdigest()
+
+def gpt_prompt_key(system_prompt):
+    """Returns the semantic cache key of a system prompt."""
+    return hashlib.sha256(f"{system_prompt}\x00{GPT_MODEL}".encode("utf-8")).hexdigest()
+
+def grouped_analysis_prompt(system_prompt):
+    """Returns the system prompt of a grouped GPT-4o request."""
+    return f"{system_prompt}\n\n{GROUPED_ANALYSIS_INSTRUCTIONS}"
+
+async def find_cached_gpt4o_response(client, user_input, system_prompt, cache_dir, semantic_cache=None, query_embedding=None):
+    """
+    Looks a request up in the exact-match cache, under both the single-file and the grouped
+    prompt, then in the semantic cache. Returns (content or None, query embedding or None,
+    whether the content is another transcript's, from the semantic cache). A
+    `query_embedding` computed earlier is reused instead of embedding again.
+    """
+    for exact_prompt in (system_prompt, grouped_analysis_prompt(system_prompt)):
+        cached_response = load_cached_json(cache_dir, gpt_cache_key(exact_prompt, user_input))
+        if cached_response is not None:
+            logging.info("Using cached GPT-4o response.")
+            return cached_response['content'], None, False
+
+    if semantic_cache is not None:
+        if query_embedding is None:
+            query_embedding = await get_query_embedding(client, user_input)
+        if query_embedding is not None:
+            cached_content = find_semantic_match(semantic_cache, query_embedding, gpt_prompt_key(system_prompt))
+            if cached_content is not None:
+                return cached_content, query_embedding, True
+    return None, query_embedding, False
+
+async def get_gpt4o_response(client, user_input, system_prompt, cache_dir, semantic_cache=None, query_embedding=None):
+    """
+    Gets a response from the OpenAI Chat API. Identical requests are served from the
+    exact-match cache; near-duplicate transcriptions are served from the semantic cache.
+    Returns (content, whether it came from the semantic cache). Raises if the API call fails.
+    """
+    cached_content, query_embedding, similar = await find_cached_gpt4o_response(
+        client, user_input, system_prompt, cache_dir, semantic_cache, query_embedding
+    )
+    if cached_content is not None:
+        return cached_content, similar
+
     logging.info("Sending request to OpenAI GPT-4o API.")
-    client = OpenAI(api_key=api_key)
+    response = await client.chat.completions.create(
+        model=GPT_MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_input}
+        ],
+        temperature=0 # As specified for deterministic output
+    )
+    logging.info("Successfully received response from GPT-4o API.")
+    content = response.choices[0].message.content
+    save_cached_json(cache_dir, gpt_cache_key(system_prompt, user_input), {'content': content})
+    if query_embedding is not None:
+        add_semantic_entry(semantic_cache, query_embedding, gpt_prompt_key(system_prompt), content)
+    return content, False
+
+def estimate_tokens(text):
+    """Cheap token estimate, about four characters per token."""
+    return len(text) // 4
+
+def group_for_analysis(results):
+    """
+    Splits result dicts into groups whose transcripts add up to at most
+    ANALYSIS_GROUP_MAX_TOKENS estimated tokens, keeping the input order.
+    """
+    groups, current, current_tokens = [], [], 0
+    for result in results:
+        tokens = estimate_tokens(result['transcription_text'])
+        if current and current_tokens + tokens > ANALYSIS_GROUP_MAX_TOKENS:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(result)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+async def get_grouped_gpt4o_responses(client, transcripts, system_prompt, cache_dir):
+    """
+    Analyzes several transcripts, given as a {filename: text} dict, in one chat completion
+    and returns {filename: analysis} for those found in the reply. Raises if the call fails.
+    Analyses are cached per transcript under the grouped prompt, apart from single-file ones.
+    """
+    grouped_prompt = grouped_analysis_prompt(system_prompt)
+    analyses = {}
+    uncached = {}
+    for filename, text in transcripts.items():
+        cached_response = load_cached_json(cache_dir, gpt_cache_key(grouped_prompt, text))
+        if cached_response is not None:
+            analyses[filename] = cached_response['content']
+        else:
+            uncached[filename] = text
+    if len(uncached) < 2:
+        return analyses
+
+    logging.info(f"Sending grouped request for {len(uncached)} transcripts to OpenAI GPT-4o API.")
+    response = await client.chat.completions.create(
+        model=GPT_MODEL,
+        messages=[
+            {"role": "system", "content": grouped_prompt},
+            {"role": "user", "content": "\n\n".join(
+                f"{ANALYSIS_FILE_MARKER.format(filename)}\n{text}" for filename, text in uncached.items()
+            )}
+        ],
+        temperature=0 # As specified for deterministic output
+    )
+    content = response.choices[0].message.content or ""
+    # re.split with one group yields [preamble, name1, body1, name2, body2, ...]
+    parts = _ANALYSIS_FILE_MARKER_RE.split(content)
+    if response.choices[0].finish_reason == "length":
+        # The reply hit the output limit, so its last analysis is cut off
+        parts = parts[:-2]
+    for filename, analysis in zip(parts[1::2], parts[2::2]):
+        filename, analysis = filename.strip(), analysis.strip()
+        if filename in uncached and analysis and filename not in analyses:
+            analyses[filename] = analysis
+            save_cached_json(cache_dir, gpt_cache_key(grouped_prompt, uncached[filename]), {'content': analysis})
+    missing = len(set(uncached) - set(analyses))
+    logging.info(f"Grouped GPT-4o response covered {len(uncached) - missing} of {len(uncached)} transcripts.")
+    return analyses
+
+def _parse_reset_seconds(value):
+    """Parses an OpenAI rate-limit reset header such as '1s', '250ms' or '6m0s' into seconds."""
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|s|m|h)', value or ''))
+
+async def wait_for_rate_limit(headers):
+    """Pauses until the window resets when less than RATE_LIMIT_LOW_WATERMARK of the rate limit is left."""
+    for kind in ('requests', 'tokens'):
+        try:
+            limit = int(headers[f'x-ratelimit-limit-{kind}'])
+            remaining = int(headers[f'x-ratelimit-remaining-{kind}'])
+        except (KeyError, ValueError):
+            continue
+        if limit > 0 and remaining < limit * RATE_LIMIT_LOW_WATERMARK:
+            delay = min(_parse_reset_seconds(headers.get(f'x-ratelimit-reset-{kind}')), 10.0)
+            logging.info(f"Only {remaining}/{limit} {kind} left in the rate limit window, pausing {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+async def transcribe_audio(session, api_semaphore, audio, source_lang_code):
+    """
+    Uploads one audio file (a Path) to the Whisper endpoint and returns the transcribed
+    text. `session` carries the API key. Reads the rate-limit headers of every response
+    to slow down before hitting the limit, and retries 429/5xx responses and network
+    errors with exponential back-off.
+    """
+    import aiohttp
+    upload_name = audio.name
+    content_type = mimetypes.guess_type(upload_name)[0] or 'application/octet-stream'
+
+    for attempt in range(WHISPER_MAX_RETRIES + 1):
+        # A FormData can only be sent once, so every attempt builds a new one
+        form = aiohttp.FormData()
+        form.add_field('model', WHISPER_MODEL)
+        form.add_field('language', source_lang_code)
+        retry_after = None
+        try:
+            # aiohttp streams an open file in chunks, so the audio is never held in memory whole
+            with open(audio, "rb") as audio_file:
+                form.add_field('file', audio_file, filename=upload_name, content_type=content_type)
+                async with api_semaphore:
+                    async with session.post(WHISPER_URL, data=form) as response:
+                        await wait_for_rate_limit(response.headers)
+                        if response.status == 200:
+                            return (await response.json())['text']
+                        error_message = f"Whisper API error {response.status}: {await response.text()}"
+                        if response.status != 429 and response.status < 500:
+                            raise RuntimeError(error_message)
+                        retry_after = response.headers.get('retry-after')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_message = f"Whisper request failed: {type(e).__name__}: {e}"
+        if attempt == WHISPER_MAX_RETRIES:
+            raise RuntimeError(error_message)
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = 2 ** attempt + random.random()
+        logging.warning(f"{error_message}. Retrying '{upload_name}' in {delay:.1f}s (attempt {attempt + 1}/{WHISPER_MAX_RETRIES}).")
+        await asyncio.sleep(delay)
+
+async def transcribe_chunk(session, api_semaphore, executor, file_path, output_base, audio_codec, window, source_lang_code):
+    """Extracts one chunk window of a media file on `executor` and transcribes it."""
+    start, duration = window
+    audio = await asyncio.get_running_loop().run_in_executor(
+        executor, extract_audio, file_path, output_base, audio_codec, start, duration
+    )
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o", # Corrected from gpt-4.1 to a valid model
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_input}
-            ],
-            temperature=0 # As specified for deterministic output
-        )
-        logging.info("Successfully received response from GPT-4o API.")
-        return response.choices[0].message.content
+        return await transcribe_audio(session, api_semaphore, audio, source_lang_code)
+    finally:
+        # Extracted chunks are temporary files in the work directory
+        if audio.exists():
+            logging.info(f"Removing temporary audio file '{audio.name}'.")
+            audio.unlink()
+
+async def get_transcription(session, api_semaphore, executor, filename, file_path, source_lang_code, paths):
+    """Returns the Whisper transcription of a media file; raises RuntimeError on failure."""
+    cache_dir = os.path.join(paths['cache'], 'whisper')
+    file_hash = await asyncio.to_thread(compute_file_sha256, file_path)
+    cache_key = f"{file_hash}_{source_lang_code}"
+    cached_transcription = load_cached_json(cache_dir, cache_key)
+    if cached_transcription is not None:
+        logging.info(f"Using cached transcription for '{filename}' (sha256 {file_hash}).")
+        return cached_transcription['text']
+
+    loop = asyncio.get_running_loop()
+    is_video = filename.lower().endswith(VIDEO_EXTENSIONS)
+    try:
+        audio_codec, duration = await loop.run_in_executor(executor, probe_audio, file_path)
+    except Exception as e:
+        if is_video:
+            logging.error(f"Probing failed for {filename}: {type(e).__name__}: {str(e)}")
+            raise RuntimeError(f"Could not read the audio track of {filename}. Error: {str(e)}") from e
+        # Audio files can still be sent to Whisper as-is, just without chunking
+        logging.warning(f"Could not probe '{filename}', sending it unchunked: {e}")
+        audio_codec, duration = None, None
+    if is_video and audio_codec is None:
+        logging.error(f"Audio extraction failed for {filename}: no audio track.")
+        raise RuntimeError(f"Could not extract audio from {filename}. Error: the file has no audio track.")
+
+    windows = get_chunk_windows(duration)
+    logging.info(f"Starting transcription for '{filename}' in {len(windows)} chunk(s)...")
+    if not is_video and len(windows) == 1:
+        # Short audio files are uploaded as they are
+        chunk_jobs = [transcribe_audio(session, api_semaphore, Path(file_path), source_lang_code)]
+    else:
+        # The random suffix keeps e.g. clip.mp4 and clip.webm from writing the same temp files
+        output_base = os.path.join(paths['work'], f"{os.path.splitext(filename)[0]}_{generate_random_string()}")
+        chunk_jobs = [
+            transcribe_chunk(
+                session, api_semaphore, executor, file_path,
+                f"{output_base}_part{index:03d}" if len(windows) > 1 else output_base,
+                audio_codec, window, source_lang_code
+            )
+            for index, window in enumerate(windows)
+        ]
+
+    chunk_texts = await asyncio.gather(*chunk_jobs, return_exceptions=True)
+    errors = [result for result in chunk_texts if isinstance(result, BaseException)]
+    if errors:
+        for error in errors:
+            logging.error(f"Transcription failed for {filename}: {type(error).__name__}: {error}")
+        raise RuntimeError(f"Transcription Error for {filename}: {str(errors[0])}")
+    logging.info("Transcription successful.")
+
+    transcription_text = merge_chunk_transcripts(chunk_texts)
+    save_cached_json(cache_dir, cache_key, {'text': transcription_text})
+    return transcription_text
+
+def format_transcript(transcription_text, analyzed_text_ai):
+    """
+    Builds the zlib-compressed content of a downloadable transcript file, part by part,
+    without joining the texts into one string first. Restore it with decompress_text.
+    """
+    compressor = zlib.compressobj(TRANSCRIPT_COMPRESSION_LEVEL)
+    parts = (
+        "--- Original Transcription ---\n", transcription_text,
+        "\n\n--- AI Analysis & Translation (Hebrew) ---\n", analyzed_text_ai,
+    )
+    return b"".join(compressor.compress(part.encode("utf-8")) for part in parts) + compressor.flush()
+
+async def analyze_result(client, api_semaphore, system_prompt, result, paths, semantic_cache=None):
+    """Runs the GPT-4o analysis of one transcribed result and fills in its analysis fields."""
+    try:
+        async with api_semaphore:
+            result['analyzed_text_ai'], similar = await get_gpt4o_response(
+                client, result['transcription_text'], system_prompt,
+                os.path.join(paths['cache'], 'gpt'), semantic_cache, result.pop('query_embedding', None)
+            )
+        if similar:
+            result['warnings'].append(SEMANTIC_CACHE_WARNING)
     except Exception as e:
         error_message = f"OpenAI API Error: {str(e)}"
-        st.error(error_message)
         logging.error(error_message)
-        return f"Error: Could not get response from AI. Details: {e}"
+        result['warnings'].append(error_message)
+        result['analyzed_text_ai'] = f"Error: Could not get response from AI. Details: {e}"
+    result['final_text_content'] = format_transcript(result['transcription_text'], result['analyzed_text_ai'])
+
+async def apply_cached_analysis(client, api_semaphore, system_prompt, result, paths, semantic_cache=None):
+    """
+    Fills in a result's analysis from the exact-match or semantic cache; returns whether it hit.
+    On a miss the query embedding is kept on the result, so the analysis doesn't embed again.
+    """
+    async with api_semaphore:
+        content, query_embedding, similar = await find_cached_gpt4o_response(
+            client, result['transcription_text'], system_prompt, os.path.join(paths['cache'], 'gpt'), semantic_cache
+        )
+    if content is None:
+        result['query_embedding'] = query_embedding
+        return False
+    if similar:
+        result['warnings'].append(SEMANTIC_CACHE_WARNING)
+    result['analyzed_text_ai'] = content
+    result['final_text_content'] = format_transcript(result['transcription_text'], content)
+    return True
+
+async def analyze_result_group(client, api_semaphore, system_prompt, group, paths, semantic_cache=None):
+    """
+    Analyzes a group of short transcripts with one grouped GPT-4o request and returns the
+    group. Files the reply does not cover fall back to one request each.
+    """
+    analyses = {}
+    if len(group) > 1:
+        try:
+            async with api_semaphore:
+                analyses = await get_grouped_gpt4o_responses(
+                    client, {result['filename']: result['transcription_text'] for result in group},
+                    system_prompt, os.path.join(paths['cache'], 'gpt')
+                )
+        except Exception as e:
+            logging.warning(f"Grouped analysis failed, falling back to one request per file: {e}")
+    fallback = []
+    for result in group:
+        if result['filename'] in analyses:
+            result['analyzed_text_ai'] = analyses[result['filename']]
+            result['final_text_content'] = format_transcript(result['transcription_text'], result['analyzed_text_ai'])
+            query_embedding = result.pop('query_embedding', None)
+            if query_embedding is not None:
+                add_semantic_entry(semantic_cache, query_embedding, gpt_prompt_key(system_prompt), result['analyzed_text_ai'])
+        else:
+            fallback.append(result)
+    await asyncio.gather(*[
+        analyze_result(client, api_semaphore, system_prompt, result, paths, semantic_cache) for result in fallback
+    ])
+    return group
 
-def process_single_file(api_key, system_prompt, filename, source_lang_code, paths):
-    """Processes a single media file: transcribes, analyzes, and returns the result."""
-    client = OpenAI(api_key=api_key)
+async def process_single_file_async(
+    client, session, api_semaphore, executor, system_prompt, filename, source_lang_code, paths,
+    semantic_cache=None, analyze=True, defer_short=False
+):
+    """
+    Processes a single media file: transcribes, analyzes, and returns the result dict.
+    With `analyze` False (batch mode) the GPT-4o step is skipped; with `defer_short`,
+    short transcripts are left unanalyzed for the caller to group.
+    """
+    result = {
+        'filename': filename,
+        'txt_filename': os.path.splitext(filename)[0] + '.txt',
+        'transcription_text': None,
+        'analyzed_text_ai': None,
+        'final_text_content': None,
+        'error': None,
+        'warnings': [],
+    }
     file_path = os.path.join(paths['to_transcribe'], filename)
     
     logging.info(f"--- Starting processing for file: {filename} ---")
     
     if not os.path.exists(file_path):
-        st.error(f"File not found: {file_path}")
         logging.error(f"File not found during processing: {file_path}")
-        return None, None
-
-    st.info(f"Processing {filename}...")
-    
-    audio_file_path = file_path
-    if filename.lower().endswith(('.mp4', '.webm', '.mpeg')):
-        try:
-            sanitized_base = os.path.splitext(filename)[0]
-            output_audio_file = os.path.join(paths['to_transcribe'], f"{sanitized_base}.mp3")
-            logging.info(f"Attempting to extract audio from video file: {filename}")
-            extract_audio(file_path, output_audio_file)
-            audio_file_path = output_audio_file
-            logging.info(f"Successfully extracted audio to: {os.path.basename(output_audio_file)}")
-        except Exception as e:
-            error_msg = f"Could not extract audio from {filename}. Error: {str(e)}"
-            st.error(error_msg)
-            logging.error(f"Audio extraction failed for {filename}: {type(e).__name__}: {str(e)}")
-            return None, None
+        result['error'] = f"File not found: {file_path}"
+        return result
 
-    logging.info(f"Starting transcription for '{os.path.basename(audio_file_path)}'...")
-    st.write(f"Transcribing {os.path.basename(audio_file_path)}...")
     try:
-        with open(audio_file_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1", file=audio_file, language=source_lang_code
-            )
-        transcription_text = transcription.text
-        st.text_area("Original Transcription", transcription_text, height=150, key=f"trans_{filename}")
-        logging.info("Transcription successful.")
+        result['transcription_text'] = await get_transcription(
+            session, api_semaphore, executor, filename, file_path, source_lang_code, paths
+        )
     except Exception as e:
-        st.error(f"Transcription Error for {filename}: {str(e)}")
-        logging.error(f"Transcription failed for {filename}: {e}")
-        return None, None
+        result['error'] = str(e)
+        return result
 
-    st.write(f"Analyzing and translating with GPT-4.1...")
-    analyzed_text_ai = get_gpt4o_response(api_key, transcription_text, system_prompt)
-    st.text_area(f"AI Analysis & Translation", analyzed_text_ai, height=250, key=f"ai_{filename}")
-    
-    final_text_content = (
-        f"--- Original Transcription ---\n{transcription_text}\n\n"
-        f"--- AI Analysis & Translation (Hebrew) ---\n{analyzed_text_ai}"
-    )
-    
-    txt_filename = os.path.splitext(filename)[0] + '.txt'
+    if analyze and not (defer_short and estimate_tokens(result['transcription_text']) <= SHORT_TRANSCRIPT_TOKENS):
+        await analyze_result(client, api_semaphore, system_prompt, result, paths, semantic_cache)
     
     try:
         logging.info(f"Moving processed file '{filename}' to done folder.")
-        shutil.move(file_path, os.path.join(paths['done_vids'], filename))
-        if audio_file_path != file_path and os.path.exists(audio_file_path):
-            logging.info(f"Removing temporary audio file '{os.path.basename(audio_file_path)}'.")
-            os.remove(audio_file_path)
+        move_file(file_path, os.path.join(paths['done_vids'], filename))
     except Exception as e:
         logging.error(f"Error during file cleanup for {filename}: {e}")
 
-    st.success(f"Finished processing {filename}.")
     logging.info(f"--- Successfully finished processing file: {filename} ---")
-    return txt_filename, final_text_content
+    return result
+
+def render_file_result(result):
+    """Shows the outcome of one processed file inside its (collapsed) status box."""
+    if result['error']:
+        st.error(result['error'])
+        return
+    for warning in result['warnings']:
+        st.warning(warning)
+    if result['final_text_content'] is not None:
+        # The texts themselves are dropped once the compressed file is in processed_files
+        st.code(decompress_text(result['final_text_content']), language=None)
+        return
+    st.caption("Original Transcription")
+    st.code(result['transcription_text'], language=None)
+
+async def process_files_async(
+    api_key, system_prompt, selected_files, source_lang_code, paths, executor, semantic_cache_lock,
+    analyze=True, on_result=None
+):
+    """Processes all selected files concurrently and returns their result dicts."""
+    import aiohttp
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    api_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    semantic_cache = load_semantic_cache(os.path.join(paths['cache'], 'semantic'), semantic_cache_lock)
 
-def run_app():
+    whisper_session = aiohttp.ClientSession(
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=aiohttp.ClientTimeout(total=WHISPER_TIMEOUT_SECONDS)
+    )
+    results = []
+    short_results = []
+    analysis_tasks = []
+
+    def finish(result):
+        if on_result is not None:
+            on_result(result)
+        results.append(result)
+
+    async def analyze_short_results(waiting):
+        # Cache hits, semantic ones included, are settled per transcript before grouping
+        hits = await asyncio.gather(*[
+            apply_cached_analysis(client, api_semaphore, system_prompt, result, paths, semantic_cache)
+            for result in waiting
+        ])
+        for result, hit in zip(waiting, hits):
+            if hit:
+                finish(result)
+        uncached_results = [result for result, hit in zip(waiting, hits) if not hit]
+        for next_group in asyncio.as_completed([
+            analyze_result_group(client, api_semaphore, system_prompt, group, paths, semantic_cache)
+            for group in group_for_analysis(uncached_results)
+        ]):
+            for result in await next_group:
+                finish(result)
+
+    openai_client = AsyncOpenAI(
+        api_key=api_key, max_retries=OPENAI_MAX_RETRIES, timeout=OPENAI_TIMEOUT_SECONDS,
+        http_client=DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+    )
+    async with openai_client as client, whisper_session:
+        try:
+            for next_result in asyncio.as_completed([
+                process_single_file_async(
+                    client, whisper_session, api_semaphore, executor, system_prompt, filename,
+                    source_lang_code, paths, semantic_cache, analyze, defer_short=analyze
+                )
+                for filename in selected_files
+            ]):
+                result = await next_result
+                if analyze and result['error'] is None and result['final_text_content'] is None:
+                    short_results.append(result)
+                else:
+                    finish(result)
+                    continue
+                # Short transcripts don't wait for longer files once a group's worth is ready
+                waiting_tokens = sum(estimate_tokens(result['transcription_text']) for result in short_results)
+                if len(short_results) >= ANALYSIS_GROUP_START_FILES or waiting_tokens >= ANALYSIS_GROUP_MAX_TOKENS:
+                    analysis_tasks.append(asyncio.create_task(analyze_short_results(short_results)))
+                    short_results = []
+            if short_results:
+                analysis_tasks.append(asyncio.create_task(analyze_short_results(short_results)))
+            await asyncio.gather(*analysis_tasks)
+        finally:
+            save_semantic_cache(semantic_cache)
+    return results
+
+def start_processing_job(api_key, system_prompt, selected_files, source_lang_code, paths, batch_mode):
+    """Submits the processing of the selected files as a background job and returns the job dict."""
+    job = {'files': selected_files, 'results': {}, 'batch_mode': batch_mode, 'finished': False}
+    # Cached resources are fetched here, on the script thread, and handed to the job
+    executor = get_ffmpeg_executor()
+    semantic_cache_lock = get_semantic_cache_lock()
+
+    def record_result(result):
+        job['results'][result['filename']] = result
+
+    job['future'] = get_job_executor().submit(lambda: asyncio.run(process_files_async(
+        api_key, system_prompt, selected_files, source_lang_code, paths, executor, semantic_cache_lock,
+        analyze=not batch_mode, on_result=record_result
+    )))
+    logging.info(f"Submitted background job for {len(selected_files)} files.")
+    return job
+
+def render_processing_job(job):
+    """Shows one status box per file of the job: queued, running, complete, or error."""
+    # A job waits in the pool while MAX_BACKGROUND_JOBS others are running
+    started = job['future'].running() or job['future'].done()
+    for filename in job['files']:
+        result = job['results'].get(filename)
+        if result is None:
+            st.status(f"Processing {filename}..." if started else f"Queued {filename}...", state="running")
+            continue
+        with st.status(filename, state="error" if result['error'] else "complete"):
+            render_file_result(result)
+
+def collect_job_results(job):
+    """
+    Copies the job's newly finished transcripts into processed_files and drops their
+    uncompressed texts from the job; returns how many were added.
+    """
+    if job['batch_mode']:
+        return 0
+    added = 0
+    for result in list(job['results'].values()):
+        if not result['error'] and result['txt_filename'] not in st.session_state.processed_files:
+            st.session_state.processed_files[result['txt_filename']] = result['final_text_content']
+            result['transcription_text'] = result['analyzed_text_ai'] = None
+            added += 1
+    return added
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def poll_processing_job(job):
+    """Shows the progress of a running job; reruns on its own, not the whole page, until the job is done."""
+    # Checked before reading the results, so a job that is done has recorded all of them
+    job_done = job['future'].done()
+    render_processing_job(job)
+    # Finished transcripts can be downloaded while the rest of the job is still running
+    if collect_job_results(job) or job_done:
+        st.rerun()
+
+def finish_processing_job(job, api_key, system_prompt):
+    """Reports the outcome of a finished job and submits its analysis batch in batch mode."""
+    job['finished'] = True
+    try:
+        job['future'].result()
+    except Exception as e:
+        st.error(f"Processing stopped unexpectedly: {str(e)}")
+        logging.error(f"Background job failed: {type(e).__name__}: {str(e)}")
+
+    results = list(job['results'].values())
+    failed_files = sum(1 for result in results if result['error'])
+    failed_files += len(job['files']) - len(results)
+    successful_files = len(job['files']) - failed_files
+
+    if job['batch_mode']:
+        transcriptions = {
+            result['txt_filename']: result['transcription_text'] for result in results if not result['error']
+        }
+        if transcriptions:
+            batch_id = submit_analysis_batch(api_key, system_prompt, transcriptions)
+            if batch_id:
+                st.session_state.pending_batch = {'batch_id': batch_id, 'transcriptions': transcriptions}
+                st.info("Transcriptions are done. The AI analysis was submitted as a batch; use 'Check batch results' to collect it.")
+
+    if failed_files == 0:
+        st.success(f"All {successful_files} files processed successfully!")
+        logging.info(f"All {successful_files} files processed successfully.")
+    elif successful_files == 0:
+        st.error(f"Failed to process all {failed_files} files.")
+        logging.error(f"Failed to process all {failed_files} files.")
+    else:
+        st.warning(f"Processed {successful_files} files successfully, {failed_files} files failed.")
+        logging.warning(f"Processing completed with {successful_files} successes and {failed_files} failures.")
+
+def submit_analysis_batch(api_key, system_prompt, transcriptions):
+    """
+    Submits one GPT-4o request per transcription to the OpenAI Batch API, which costs
+    half as much as the synchronous endpoint and completes within 24 hours.
+    `transcriptions` maps output txt filenames (used as custom_id) to transcription text.
+    Returns the batch id, or None on failure.
+    """
+    logging.info(f"Submitting {len(transcriptions)} GPT-4o requests to the Batch API.")
+    requests_jsonl = "\n".join(
+        json.dumps({
+            "custom_id": txt_filename,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": GPT_MODEL,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": transcription_text}
+                ],
+                "temperature": 0
+            }
+        }, ensure_ascii=False)
+        for txt_filename, transcription_text in transcriptions.items()
+    )
+    client = get_openai_client(api_key)
+    try:
+        batch_file = client.files.create(
+            file=("analysis_batch.jsonl", requests_jsonl.encode("utf-8")), purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+        )
+    except Exception as e:
+        error_message = f"Could not submit the analysis batch: {str(e)}"
+        st.error(error_message)
+        logging.error(error_message)
+        return None
+    logging.info(f"Submitted analysis batch '{batch.id}'.")
+    return batch.id
+
+def check_analysis_batch(api_key, system_prompt, pending_batch, paths):
+    """Polls a submitted analysis batch; returns None while it is running, else the transcript files."""
+    client = get_openai_client(api_key)
+    batch_id = pending_batch['batch_id']
+    try:
+        batch = client.batches.retrieve(batch_id)
+    except Exception as e:
+        error_message = f"Could not check the analysis batch: {str(e)}"
+        st.error(error_message)
+        logging.error(error_message)
+        return None
+
+    logging.info(f"Analysis batch '{batch_id}' status: {batch.status}.")
+    if batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} done)" if counts else ""
+        st.info(f"Batch is {batch.status.replace('_', ' ')}{progress}. Check again later.")
+        return None
+    if not batch.output_file_id:
+        st.error(f"The analysis batch ended with status '{batch.status}' and returned no results.")
+        logging.error(f"Analysis batch '{batch_id}' ended with status '{batch.status}' and no output.")
+        return {}
+
+    results = {}
+    cache_dir = os.path.join(paths['cache'], 'gpt')
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        txt_filename = item['custom_id']
+        transcription_text = pending_batch['transcriptions'].get(txt_filename)
+        response = item.get('response') or {}
+        if transcription_text is None or response.get('status_code') != 200:
+            logging.error(f"Batch request for '{txt_filename}' failed: {item.get('error') or response}")
+            continue
+        analyzed_text_ai = response['body']['choices'][0]['message']['content']
+        save_cached_json(cache_dir, gpt_cache_key(system_prompt, transcription_text), {'content': analyzed_text_ai})
+        results[txt_filename] = format_transcript(transcription_text, analyzed_text_ai)
+    missing = len(pending_batch['transcriptions']) - len(results)
+    if missing:
+        st.warning(f"{missing} of the batch requests did not return an analysis.")
+    return results
+
+def run_app(paths):
     """The main application logic, shown after password authentication."""
     st.markdown("""
     <div dir="rtl" style="text-align: center;">
@@ -241,87 +1224,99 @@ def run_app():
 
     source_language = st.selectbox(
         "Select source language of the media",
-        ["Arabic", "Hebrew", "English"], index=0
+        list(LANGUAGE_CODES), index=0
     )
-    language_codes = {"Arabic": "ar", "Hebrew": "he", "English": "en"}
-    source_lang_code = language_codes[source_language]
+    source_lang_code = LANGUAGE_CODES[source_language]
 
     fb_video_url = st.text_input("Enter Facebook video URL (optional)")
+    batch_mode = st.checkbox(
+        "Batch mode: run the AI analysis through the OpenAI Batch API (50% cheaper, results within 24 hours)"
+    )
     uploaded_files = st.file_uploader(
         "Or upload local audio/video files",
-        type=['mp4', 'm4a', 'mp3', 'webm', 'mpga', 'wav', 'mpeg'],
+        type=[extension.lstrip('.') for extension in SUPPORTED_EXTENSIONS],
         accept_multiple_files=True
     )
 
-    # Use a relative directory path that's writable in Streamlit Community Cloud
-    base_temp_dir = os.path.join(".", "temp_files")
-    paths = {
-        'logs': os.path.join(base_temp_dir, 'logs'),
-        'to_transcribe': os.path.join(base_temp_dir, 'to_transcribe'),
-        'done_vids': os.path.join(base_temp_dir, 'done_vids')
-    }
-    
-    # Create directories if they don't exist
-    for path in paths.values():
-        os.makedirs(path, exist_ok=True)
-    
+    # Transcripts are held zlib-compressed and only decompressed for the download buttons
+    if 'processed_files' not in st.session_state:
+        st.session_state.processed_files = {}
+
+    # file_ids of the uploads already saved; a processed upload is moved to done_vids but keeps its id
+    if 'saved_upload_ids' not in st.session_state:
+        st.session_state.saved_upload_ids = set()
+
     if uploaded_files:
         logging.info(f"Detected {len(uploaded_files)} uploaded files.")
         for uploaded_file in uploaded_files:
+            # Streamlit reruns the script on every interaction; don't save the same upload again
+            if uploaded_file.file_id in st.session_state.saved_upload_ids:
+                continue
             sanitized_name = sanitize_filename(uploaded_file.name)
             save_path = os.path.join(paths['to_transcribe'], sanitized_name)
-            with open(save_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            # Stream in 1 MiB chunks so large videos are never fully materialized in memory
+            uploaded_file.seek(0)
+            with open(save_path, "wb", buffering=UPLOAD_CHUNK_SIZE) as f:
+                shutil.copyfileobj(uploaded_file, f, length=UPLOAD_CHUNK_SIZE)
+            st.session_state.saved_upload_ids.add(uploaded_file.file_id)
             logging.info(f"Saved uploaded file to '{save_path}'.")
 
-    if st.button("Start Transcription and Translation", type="primary"):
+    job = st.session_state.get('job')
+    job_running = job is not None and not job['future'].done()
+    if st.button("Start Transcription and Translation", type="primary", disabled=job_running):
         logging.info("'Start' button clicked.")
         st.session_state.processed_files = {}
         selected_files = []
         
         if fb_video_url:
             with st.spinner("Downloading video..."):
-                downloaded_file = download_facebook_video(fb_video_url, paths['to_transcribe'])
+                downloaded_file = download_facebook_video(fb_video_url, paths['to_transcribe'], paths['done_vids'])
                 if downloaded_file:
                     selected_files.append(downloaded_file)
         
-        files_in_dir = os.listdir(paths['to_transcribe'])
+        files_in_dir = list_media_files(paths['to_transcribe'])
         logging.info(f"Files found in 'to_transcribe' directory: {files_in_dir}")
-        selected_files.extend([f for f in files_in_dir if f not in selected_files])
+        # dict.fromkeys drops duplicates in O(N) while keeping the processing order deterministic
+        selected_files = list(dict.fromkeys(selected_files + files_in_dir))
         
         if selected_files:
             logging.info(f"Starting processing for {len(selected_files)} files: {selected_files}")
-            successful_files = 0
-            failed_files = 0
-            with st.spinner("Processing files... This may take a few minutes."):
-                for filename in selected_files:
-                    txt_filename, content = process_single_file(api_key, system_prompt, filename, source_lang_code, paths)
-                    if txt_filename and content:
-                        st.session_state.processed_files[txt_filename] = content
-                        successful_files += 1
-                    else:
-                        failed_files += 1
-            
-            if failed_files == 0:
-                st.success(f"All {successful_files} files processed successfully!")
-                logging.info(f"All {successful_files} files processed successfully.")
-            elif successful_files == 0:
-                st.error(f"Failed to process all {failed_files} files.")
-                logging.error(f"Failed to process all {failed_files} files.")
-            else:
-                st.warning(f"Processed {successful_files} files successfully, {failed_files} files failed.")
-                logging.warning(f"Processing completed with {successful_files} successes and {failed_files} failures.")
+            job = st.session_state.job = start_processing_job(
+                api_key, system_prompt, selected_files, source_lang_code, paths, batch_mode
+            )
+            job_running = True
         else:
             st.warning("Please upload at least one file or provide a valid Facebook video URL.")
             logging.warning("No files selected or found for processing.")
 
+    if job is not None:
+        st.markdown("---")
+        if job_running:
+            poll_processing_job(job)
+        else:
+            render_processing_job(job)
+            if not job['finished']:
+                collect_job_results(job)
+                finish_processing_job(job, api_key, system_prompt)
+
+    if st.session_state.get('pending_batch'):
+        st.markdown("---")
+        st.write(f"Pending analysis batch: `{st.session_state.pending_batch['batch_id']}`")
+        if st.button("Check batch results"):
+            results = check_analysis_batch(api_key, system_prompt, st.session_state.pending_batch, paths)
+            if results is not None:
+                st.session_state.processed_files.update(results)
+                del st.session_state.pending_batch
+                if results:
+                    st.success(f"Collected {len(results)} analyses from the batch.")
+
     if 'processed_files' in st.session_state and st.session_state.processed_files:
         st.markdown("---")
         st.header("Download Transcripts")
-        for filename, content in st.session_state.processed_files.items():
+        for filename, blob in st.session_state.processed_files.items():
             st.download_button(
                 label=f"⬇️ Download {filename}",
-                data=content,
+                data=decompress_text(blob),
                 file_name=filename,
                 mime="text/plain"
             )
@@ -330,12 +1325,8 @@ def main():
     st.set_page_config(layout="centered")
     st.title("Audio/Video Transcription App")
 
-    # Setup logging at the very beginning
-    # Use a relative directory path that's writable in Streamlit Community Cloud
-    base_temp_dir = os.path.join(".", "temp_files")
-    log_path = os.path.join(base_temp_dir, 'logs')
-    os.makedirs(log_path, exist_ok=True)
-    setup_logging(log_path)
+    # Setup logging and the working directories at the very beginning
+    paths = init_app()
 
     try:
         correct_password = st.secrets["login_pass"]
@@ -348,7 +1339,7 @@ def main():
 
     if password == correct_password:
         logging.info("Password correct. Loading main application.")
-        run_app()
+        run_app(paths)
     elif password:
         st.error("Password incorrect. Please try again.")
         logging.warning("Incorrect password entered.")